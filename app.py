@@ -1,16 +1,62 @@
 from pathlib import Path
-import datetime
+import os
+import time
 from flask import Flask, jsonify, render_template, request
-
-from database import db
+import msgspec
+from sqlalchemy import delete, exists, insert, select
+from sqlalchemy.orm import raiseload, selectinload
+from sqlalchemy.pool import QueuePool
+
+from cache import cache
+from database import begin_immediate, db
+from json_provider import OrjsonProvider
+from models import DATE_FORMAT
 from models import Product
 from models import Order
 from models import ProductsOrder
+from schemas import create_order_decoder, create_product_decoder, update_order_decoder
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///store.db"
+# Pin the connection pool size and overflow explicitly; the lock wait comes from the
+# busy_timeout PRAGMA in database.py
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+    "poolclass": QueuePool,
+    "pool_size": 8,
+    "max_overflow": 4,
+    "pool_pre_ping": False,
+    "pool_recycle": -1,
+    "connect_args": {"check_same_thread": False},
+}
+# Use Redis when it is configured, otherwise an in-process cache
+if os.environ.get("CACHE_REDIS_URL"):
+    app.config["CACHE_TYPE"] = "RedisCache"
+    app.config["CACHE_REDIS_URL"] = os.environ["CACHE_REDIS_URL"]
+else:
+    app.config["CACHE_TYPE"] = "SimpleCache"
 app.instance_path = Path(".").resolve()
 db.init_app(app)
+cache.init_app(app)
+
+# Cache key for the /api/products listing, cleared whenever product data changes
+PRODUCTS_CACHE_KEY = "products:all"
+
+
+def order_load_options() -> list:
+    """
+    Builds the loader options used when querying orders.
+
+    Order lines and their products are eager-loaded in one query per tier. In debug mode any
+    other lazy load raises, so N+1 regressions in to_dict show up during development.
+
+    Returns:
+        list: The SQLAlchemy loader options to pass to the query.
+    """
+    options = [selectinload(Order.products).joinedload(ProductsOrder.product)]
+    if app.debug:
+        options.append(raiseload("*"))
+    return options
 
 
 @app.route("/")
@@ -21,7 +67,8 @@ def home() -> str:
     Returns:
         str: A HTML string that displays all the products available in the store.
     """
-    data = Product.query.all()
+    # Rows expose name/price/quantity as attributes, which is all the template reads
+    data = db.session.execute(select(Product.name, Product.price, Product.quantity)).all()
     return render_template("index.html", products=data)
 
 @app.route("/api/product/<string:name>", methods=["GET"])
@@ -34,7 +81,7 @@ def api_get_product(name) -> dict:
     Returns:
         json: A JSON object that represents the retrieved product in a dict or an error message.
     """
-    product = db.session.get(Product, name.lower())
+    product = db.session.get(Product, Product.normalize_name(name))
     if product is None:
         return f"Item not found in the database", 404
     product_json = product.to_dict()
@@ -50,31 +97,20 @@ def api_create_product():
         str: A message indicating whether the product was added to the database or 
              an error message if the provided JSON data is invalid.
     """
-    data = request.json
-    # Check all data is provided
-    for key in ("name", "price", "quantity"):
-        if key not in data:
-            return f"The JSON provided is invalid (missing: {key})", 400
-
+    # Parse and validate the body in one pass
     try:
-        price = float(data["price"])
-        quantity = int(data["quantity"])
-        # Make sure they are positive
-        if price < 0 or quantity < 0:
-            raise ValueError
-    except ValueError:
-        return (
-            "Invalid values: price must be a positive float and quantity a positive integer",
-            400,
-        )
+        data = create_product_decoder.decode(request.get_data())
+    except msgspec.DecodeError as e:
+        return f"The JSON provided is invalid ({e})", 400
 
     product = Product(
-        name=data["name"],
-        price=price,
-        quantity=quantity,
+        name=data.name,
+        price=data.price,
+        quantity=data.quantity,
     )
     db.session.add(product)
     db.session.commit()
+    cache.delete(PRODUCTS_CACHE_KEY)
     return "Item added to the database"
 
 
@@ -89,9 +125,14 @@ def api_delete_product(name):
     Returns:
         str: A message indicating whether the product was deleted from the database.
     """
-    product = db.session.get(Product, name.lower())
+    name = Product.normalize_name(name)
+    # Foreign keys are enforced, so a product still used by an order can't be removed
+    if db.session.scalar(select(exists().where(ProductsOrder.product_name == name))):
+        return "Product is part of an order and can't be deleted", 400
+    product = db.session.get(Product, name)
     db.session.delete(product)
     db.session.commit()
+    cache.delete(PRODUCTS_CACHE_KEY)
     return 'Product deleted from the database'
 
 
@@ -122,10 +163,11 @@ def api_update_product(name):
             "Invalid values: price must be a positive float and quantity a positive integer",
             400,
         )
-    product = db.session.get(Product, name.lower())
+    product = db.session.get(Product, Product.normalize_name(name))
     product.price = price
     product.quantity = quantity
     db.session.commit()
+    cache.delete(PRODUCTS_CACHE_KEY)
     return 'Product updated'
 
 
@@ -140,7 +182,7 @@ def api_get_order(order_id):
     Returns:
         json: A JSON object that represents the retrieved order.
     """
-    order = db.session.get(Order, order_id)
+    order = db.session.get(Order, order_id, options=order_load_options())
     order_json = order.to_dict(True)
     return jsonify(order_json)
 
@@ -156,27 +198,27 @@ def api_process_order(order_id):
     Returns:
         json: A JSON object that represents the processed order.
     """
-    order = db.session.get(Order, order_id)
-    now = datetime.datetime.now()
-    date = now.strftime("%Y-%m-%d %H:%M")
+    begin_immediate()
+    order = db.session.get(Order, order_id, options=order_load_options())
 
+    # Products were already joined in by order_load_options, so this needs no extra queries
     for product_order in order.products:
-        product_obj = db.session.get(Product, product_order.product_name)
+        product_obj = product_order.product
         if (product_obj.quantity - product_order.quantity) < 0:
             product_order.quantity = product_obj.quantity
             product_obj.quantity = 0
         else:
             product_obj.quantity -= product_order.quantity
 
-        db.session.add(product_obj)
-        db.session.commit()
-    order.date_processed = date
+    order.date_processed = int(time.time())
     order.completed = True
-    db.session.add(order)
-
+    # Serialize before committing, while everything is still loaded, so the commit's
+    # expiry doesn't force the order to be fetched again
+    order_json = order.to_dict(True)
     db.session.commit()
+    cache.delete(PRODUCTS_CACHE_KEY)
 
-    return api_get_order(order_id)
+    return jsonify(order_json)
 
 
 @app.route("/api/order", methods=["POST"])
@@ -187,56 +229,50 @@ def api_create_order():
     Returns:
         json: A JSON object that represents the newly created order or an error message if the provided JSON data is invalid.
     """
-    data = request.json
-    # Check all data is provided
+    # Parse and validate the body, including every product line, in one pass
+    try:
+        data = create_order_decoder.decode(request.get_data())
+    except msgspec.DecodeError as e:
+        return f"The JSON provided is invalid ({e})", 400
+    # Dates arrive in DATE_FORMAT but are stored as timestamps
+    try:
+        date_processed = Order.parse_date(data.date_processed)
+    except ValueError:
+        return f"The JSON provided is invalid (date_processed must use the format {DATE_FORMAT})", 400
 
-    for key in ("customer_name", "customer_address", "completed", "products", "date_created", "date_processed"):
-        if key not in data:
-            return f"The JSON provided is invalid (missing: {key})", 400
-    for item in data["products"]:
-        for key in item.keys():
-            if key not in ("product_name", "quantity"):
-                return f"The JSON provided is invalid, 'products' is missing a key", 400
+    begin_immediate()
+    names = [Product.normalize_name(product.product_name) for product in data.products]
+    existing = set(db.session.scalars(select(Product.name).where(Product.name.in_(names))))
 
-    for product in data["products"]:
-        if db.session.get(Product, product["product_name"]) is None:
+    # Check each product exists and appears once, and build its order line in the same pass
+    product_lines = []
+    seen = set()
+    for name, product in zip(names, data.products):
+        if name not in existing:
             return f"Item not found in the database", 400
-
-    if not isinstance(data['completed'], bool):
-        return f"The JSON completed provided is invalid", 400
-
-    try:
-        product_orders = []
-        for product in data["products"]:
-            if db.session.get(Product, product["product_name"]) is None:
-                return f"Item not found in the database", 400
-            else:
-                quantity = int(product["quantity"])
-            if quantity < 0:
-                raise ValueError
-
-            else:
-                product_obj = ProductsOrder(
-                    product_name=product["product_name"], quantity=quantity)
-                product_orders.append(product_obj)
-    except ValueError:
-        return (
-            "Invalid values: quantity must be a positive integer",
-            400,
-        )
+        if name in seen:
+            return f"The JSON provided is invalid ({name} is listed more than once)", 400
+        seen.add(name)
+        product_lines.append({"product_name": name, "quantity": product.quantity})
     order = Order(
-        name=data["customer_name"],
-        address=data["customer_address"],
-        completed=data["completed"],
-        date_created=data["date_created"],
-        date_processed=data["date_processed"],
-        products=product_orders)
+        name=data.customer_name,
+        address=data.customer_address,
+        completed=data.completed,
+        date_created=data.date_created,
+        date_processed=date_processed)
     db.session.add(order)
+    # Flush to get the order ID, then insert all the order lines in one statement
+    db.session.flush()
+    if product_lines:
+        db.session.execute(
+            insert(ProductsOrder),
+            [dict(line, order_id=order.id) for line in product_lines])
     db.session.commit()
     order_json = order.to_dict()
     return jsonify(order_json)
 
 @app.route("/api/products", methods=["GET"])
+@cache.cached(timeout=300, key_prefix=PRODUCTS_CACHE_KEY)
 def get_products() -> str:
     """
     Renders the home page of the web application with all the products available in the store.
@@ -244,11 +280,10 @@ def get_products() -> str:
     Returns:
         str: A HTML string that displays all the products available in the store.
     """
-    product_lists = []
-    data = Product.query.all()
-    for product in data:
-        product_lists.append(product.to_dict())
-    return jsonify(product_lists)
+    rows = db.session.execute(select(Product.name, Product.price, Product.quantity)).all()
+    return jsonify([
+        {"name": name, "quantity": quantity, "price": price} for name, price, quantity in rows
+    ])
 
 @app.route("/api/orders", methods=["GET"])
 def get_orders() -> str:
@@ -259,7 +294,7 @@ def get_orders() -> str:
         str: A HTML string that displays all the products available in the store.
     """
     order_list = []
-    data = Order.query.all()
+    data = db.session.scalars(select(Order).options(*order_load_options())).all()
     for order in data:
         order_list.append(order.to_dict(True))
     return jsonify(order_list)
@@ -292,40 +327,29 @@ def api_update_order(order_id):
     Returns:
         str: A message indicating whether the product was updated or an error message if the provided JSON data is invalid.
     """
-    data = request.json
-    # Check all data is provided
-
-    for item in data:
-        for key in item.keys():
-            if key not in ("product_name", "quantity"):
-                return f"The JSON provided is invalid, 'products' is missing a key", 400
-
-    for product in data:
-        if db.session.get(Product, product["product_name"]) is None:
-            return f"Item not found in the database", 400
-
+    # Parse and validate the list of product lines in one pass
     try:
-        product_orders = []
-        for product in data:
-            if db.session.get(Product, product["product_name"]) is None:
-                return f"Item not found in the database", 400
-            else:
-                quantity = int(product["quantity"])
-            if quantity < 0:
-                raise ValueError
-            product_obj = ProductsOrder(
-                product_name=product["product_name"], quantity=quantity)
-            product_orders.append(product_obj)
-    except ValueError:
-        return (
-            "Invalid values: quantity must be a positive integer",
-            400,
-        )
-    for item in data:
-        product_order = db.session.query(ProductsOrder).get((item['product_name'], order_id ))
-        db.session.delete(product_order)
-    order = db.session.get(Order, order_id)
-    order.products = product_orders
+        data = update_order_decoder.decode(request.get_data())
+    except msgspec.DecodeError as e:
+        return f"The JSON provided is invalid ({e})", 400
+
+    begin_immediate()
+    if db.session.get(Order, order_id) is None:
+        return "Order not found in the database", 404
+    names = [Product.normalize_name(product.product_name) for product in data]
+    existing = set(db.session.scalars(select(Product.name).where(Product.name.in_(names))))
+    if set(names) - existing:
+        return f"Item not found in the database", 400
+    if len(set(names)) != len(names):
+        return f"The JSON provided is invalid (a product is listed more than once)", 400
+
+    # Replace the order lines with a single DELETE and a single INSERT
+    db.session.execute(delete(ProductsOrder).where(ProductsOrder.order_id == order_id))
+    if names:
+        db.session.execute(
+            insert(ProductsOrder),
+            [{"product_name": name, "order_id": order_id, "quantity": product.quantity}
+             for name, product in zip(names, data)])
     db.session.commit()
     return "Order Updated successfully"
 
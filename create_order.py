@@ -1,5 +1,7 @@
 import random
 
+from sqlalchemy import func, insert, select
+
 from app import app, db
 from models import Order, Product, ProductsOrder
 import datetime
@@ -10,16 +12,19 @@ date = now.strftime("%Y-%m-%d %H:%M")
 with app.app_context():
     o = Order(name="Tim", address="Vancouver", date_created=date, completed=False)
     db.session.add(o)
-    db.session.commit()
+    # Flush to get the order ID; everything is committed once at the end
+    db.session.flush()
 
     print("New order, with ID", o.id)
 
     # Let's add five random products with random quantities to the order
-    products = random.sample(Product.query.all(), k=5)
+    # Let SQLite pick them so only the names are loaded, not every Product row
+    product_names = db.session.scalars(
+        select(Product.name).order_by(func.random()).limit(5)).all()
 
-    for p in products:
-        quantity = random.randint(1, 10)
-        association = ProductsOrder(product=p, order=o, quantity=quantity)
-        db.session.add(association)
+    db.session.execute(
+        insert(ProductsOrder),
+        [{"product_name": name, "order_id": o.id, "quantity": random.randint(1, 10)}
+         for name in product_names])
 
     db.session.commit()
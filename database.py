@@ -1,3 +1,46 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 db = SQLAlchemy()
+
+# Applied to every new SQLite connection
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Turns on WAL and tunes SQLite for concurrent readers and cheaper commits."""
+    # Stop pysqlite from emitting its own BEGIN so the "begin" listener below controls it
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+@event.listens_for(Engine, "begin")
+def do_begin(conn):
+    """Emits BEGIN, or BEGIN IMMEDIATE when the transaction was opened by begin_immediate()."""
+    if conn.get_execution_options().get("begin_immediate"):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+    else:
+        conn.exec_driver_sql("BEGIN")
+
+
+def begin_immediate():
+    """
+    Starts the session's transaction with BEGIN IMMEDIATE.
+
+    Taking the write lock up front avoids SQLITE_BUSY errors when a deferred transaction
+    has to upgrade from read to write while another writer holds the lock. Must be called
+    before the session runs any other statement in the transaction.
+    """
+    db.session.connection(execution_options={"begin_immediate": True})
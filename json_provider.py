@@ -0,0 +1,29 @@
+import orjson
+from flask.json.provider import JSONProvider
+
+# Sorted keys match the output of Flask's default provider
+ORJSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_SORT_KEYS
+
+
+class OrjsonProvider(JSONProvider):
+    """
+    Flask JSON provider that encodes and decodes with orjson instead of the standard library.
+
+    Methods:
+    - dumps(obj): Serializes obj to a JSON string.
+    - loads(s): Deserializes a JSON string or bytes.
+    - response(*args, **kwargs): Builds a JSON response from the encoded bytes directly.
+    """
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, option=ORJSON_OPTIONS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Skip the bytes -> str -> bytes round trip that dumps() would add
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, option=ORJSON_OPTIONS), mimetype="application/json"
+        )
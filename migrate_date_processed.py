@@ -0,0 +1,32 @@
+from sqlalchemy import text
+
+from app import app, db
+from models import Order
+
+# Converts "order".date_processed from "%Y-%m-%d %H:%M" strings (read as UTC) to Unix timestamps
+with app.app_context():
+    columns = db.session.execute(text('PRAGMA table_info("order")')).all()
+    column_type = next(column.type for column in columns if column.name == "date_processed")
+    if column_type == "INTEGER":
+        print("date_processed is already stored as a timestamp.")
+    else:
+        rows = db.session.execute(text('SELECT id, date_processed FROM "order"')).all()
+        db.session.execute(text('ALTER TABLE "order" DROP COLUMN date_processed'))
+        db.session.execute(text('ALTER TABLE "order" ADD COLUMN date_processed INTEGER'))
+        db.session.execute(text('CREATE INDEX ix_order_date_processed ON "order" (date_processed)'))
+        timestamps = []
+        for row in rows:
+            try:
+                date_processed = Order.parse_date(row.date_processed)
+            except ValueError:
+                # Older versions of the API accepted any string, leave those orders unprocessed
+                print("Skipping order", row.id, "with unrecognised date", repr(row.date_processed))
+                continue
+            if date_processed is not None:
+                timestamps.append({"id": row.id, "date_processed": date_processed})
+        if timestamps:
+            db.session.execute(
+                text('UPDATE "order" SET date_processed = :date_processed WHERE id = :id'),
+                timestamps)
+        db.session.commit()
+        print("Converted", len(timestamps), "processed dates to timestamps.")
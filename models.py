@@ -1,22 +1,41 @@
+import datetime
+
+from sqlalchemy.orm import validates
+
 from database import db
 
+# How dates are written in the API; they are always read and written as UTC
+DATE_FORMAT = "%Y-%m-%d %H:%M"
+
 
 class Product(db.Model):
     """
     Represents a product with a name, price, and quantity.
 
     Attributes:
-    - name (str): The name of the product (primary key).
+    - name (str): The name of the product (primary key, stored stripped and lowercased).
     - price (float): The price of the product (must be non-null).
     - quantity (int): The quantity of the product (nullable).
+    - orders (list of ProductsOrder): The order lines that include this product.
 
     Methods:
     - to_dict(): Returns a dictionary representation of the object.
     - remove(): Removes the object from the database. 
+    - normalize_name(name): Returns the canonical form of a product name.
     """
     name = db.Column(db.String, primary_key=True)
     price = db.Column(db.Float, nullable=False)
     quantity = db.Column(db.Integer, nullable=True)
+    orders = db.relationship('ProductsOrder', back_populates='product')
+
+    @staticmethod
+    def normalize_name(name: str) -> str:
+        """Strips and lowercases a product name so lookups always match the primary key."""
+        return name.strip().lower()
+
+    @validates('name')
+    def validate_name(self, key, name):
+        return self.normalize_name(name)
     
     def to_dict(self):
         return {"name": self.name, "quantity": self.quantity, "price": self.price,}
@@ -37,6 +56,7 @@ class Order(db.Model):
 
     Methods:
     - to_dict(): Returns a dictionary representation of the object, including the list of products and the total price of the order.
+    - parse_date(value): Converts an API date string to a Unix timestamp.
     """
 
     id = db.Column(db.Integer, primary_key=True)
@@ -44,8 +64,17 @@ class Order(db.Model):
     address = db.Column(db.String)
     completed = db.Column(db.Boolean)
     date_created = db.Column(db.String)
-    date_processed = db.Column(db.String)
+    # Unix timestamp, formatted only when serialized
+    date_processed = db.Column(db.Integer, index=True)
     products = db.relationship('ProductsOrder', back_populates='order', cascade="all")
+
+    @staticmethod
+    def parse_date(value):
+        """Converts a UTC DATE_FORMAT string to a Unix timestamp; None or "" mean no date."""
+        if not value:
+            return None
+        date = datetime.datetime.strptime(value, DATE_FORMAT).replace(tzinfo=datetime.timezone.utc)
+        return int(date.timestamp())
     
     def to_dict(self, id_bool=False) -> dict:
         """Forms a dict using the order and products
@@ -57,15 +86,11 @@ class Order(db.Model):
         dic = {}
         product_list = []
         price = 0
-        for product in self.products:
-            product_list.append(product.to_dict())
-            
-        for item in product_list:
+        for product_order in self.products:
+            item = product_order.to_dict()
             item.pop('order_id')
-
-        for item in product_list:
-            product = db.session.get(Product, item["product_name"])
-            price += product.to_dict()['price'] * item["quantity"]
+            product_list.append(item)
+            price += product_order.product.price * product_order.quantity
         if id_bool == True:
             dic["order_id"] = self.id
             dic["completed"] = self.completed
@@ -73,7 +98,10 @@ class Order(db.Model):
         dic["customer_name"] = self.name
         dic["customer_address"] = self.address
         dic["date_created"] = self.date_created
-        dic["date_processed"] = self.date_processed
+        dic["date_processed"] = (
+            datetime.datetime.fromtimestamp(self.date_processed, datetime.timezone.utc)
+            .strftime(DATE_FORMAT)
+            if self.date_processed is not None else None)
         dic["products"] = product_list
         dic["price"] = round(price, 2)
         return dic
@@ -94,6 +122,10 @@ class ProductsOrder(db.Model):
     Methods:
     - to_dict(): Returns a dictionary representation of the object.
     """
+    # Covers the per-order lookups, so quantity is read from the index without the table
+    __table_args__ = (
+        db.Index('ix_po_order_covers', 'order_id', 'product_name', 'quantity'),
+    )
     # Product foreign key is name
     product_name = db.Column(db.ForeignKey("product.name"), primary_key=True)
     # Order foreign key is ID
@@ -101,7 +133,7 @@ class ProductsOrder(db.Model):
     # This is how many items we want
     quantity = db.Column(db.Integer, nullable=False)
     # Relationships and backreferences for SQL Alchemy
-    product = db.relationship('Product')
+    product = db.relationship('Product', back_populates='orders')
     order = db.relationship('Order', back_populates='products')
     def to_dict(self):
         return {"product_name": self.product_name, "order_id": self.order_id, "quantity": self.quantity}
@@ -0,0 +1,65 @@
+from typing import Optional
+
+import msgspec
+
+
+class CreateProduct(msgspec.Struct):
+    """
+    Represents the JSON body used to create a product.
+
+    Attributes:
+    - name (str): The name of the product.
+    - price (float): The price of the product (must be positive).
+    - quantity (int): The quantity of the product in stock (must be positive).
+    """
+    name: str
+    price: float
+    quantity: int
+
+    def __post_init__(self):
+        if self.price < 0 or self.quantity < 0:
+            raise ValueError("price must be a positive float and quantity a positive integer")
+
+
+class ProductLine(msgspec.Struct, forbid_unknown_fields=True):
+    """
+    Represents one product line of an order in a JSON body.
+
+    Attributes:
+    - product_name (str): The name of the product.
+    - quantity (int): How many of the product are ordered (must be positive).
+    """
+    product_name: str
+    quantity: int
+
+    def __post_init__(self):
+        if self.quantity < 0:
+            raise ValueError("quantity must be a positive integer")
+
+
+class CreateOrder(msgspec.Struct):
+    """
+    Represents the JSON body used to create an order.
+
+    Attributes:
+    - customer_name (str): The name of the customer placing the order.
+    - customer_address (str): The address of the customer placing the order.
+    - completed (bool): Whether the order has been completed.
+    - date_created (str): When the order was created.
+    - date_processed (str or None): When the order was processed, if it has been ("" also means not processed).
+    - products (list of ProductLine): The products included in the order.
+    """
+    customer_name: str
+    customer_address: str
+    completed: bool
+    date_created: str
+    date_processed: Optional[str]
+    products: list[ProductLine]
+
+
+# strict=False keeps accepting numbers sent as strings, like the old float()/int() checks did
+create_product_decoder = msgspec.json.Decoder(CreateProduct, strict=False)
+# Orders are strict so `completed` must be a JSON boolean, not "true" or 1; this also means
+# product line quantities must be JSON integers, numeric strings like "3" are rejected
+create_order_decoder = msgspec.json.Decoder(CreateOrder)
+update_order_decoder = msgspec.json.Decoder(list[ProductLine])